@@ -0,0 +1,150 @@
+"""
+LLM/RAG Audit Log for DCL
+Structured JSON-lines records of every LLM and RAG call, written by a
+background thread in batches. Files rotate by size; rotated segments can be
+compacted into ZSTD Parquet for offline analysis with DuckDB.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+# Every record carries the same keys so rotated segments share one schema (DuckDB types for compaction)
+RECORD_TYPES: Dict[str, str] = {
+    "ts": "TIMESTAMP WITH TIME ZONE", "kind": "VARCHAR", "call": "VARCHAR", "model": "VARCHAR", "source": "VARCHAR",
+    "prompt_sha1": "VARCHAR", "latency_s": "DOUBLE", "prompt_tokens": "BIGINT", "completion_tokens": "BIGINT",
+    "outcome": "VARCHAR", "cache_hit": "BOOLEAN", "error": "VARCHAR", "detail": "VARCHAR",
+}
+RECORD_FIELDS = tuple(RECORD_TYPES)
+MAX_DETAIL_CHARS = 8000
+
+logger = logging.getLogger("dcl.audit")
+
+
+def prompt_hash(prompt: Optional[str]) -> Optional[str]:
+    return hashlib.sha1(prompt.encode()).hexdigest() if prompt else None
+
+
+class AuditLog:
+    """
+    Non-blocking audit log writer.
+
+    `record()` only enqueues; a daemon thread drains the queue, appends each batch
+    with a single write, and rotates `path` once it exceeds `max_bytes`. With
+    `parquet_dir` set, each rotated segment is compacted to Parquet (kept for offline
+    analysis) instead of being kept as a numbered backup.
+    """
+
+    def __init__(self,
+                 path: str,
+                 max_bytes: int = 10 * 1024 * 1024,
+                 backups: int = 5,
+                 parquet_dir: Optional[str] = None,
+                 batch_size: int = 256,
+                 flush_interval_s: float = 1.0,
+                 max_queue: int = 10000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.parquet_dir = parquet_dir
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(max_queue)
+        self._thread = threading.Thread(target=self._run, name="audit-log", daemon=True)
+        self._thread.start()
+
+    def record(self, kind: str, call: str, **fields: Any):
+        """Queue one record; never blocks. Records are dropped (and counted) if the queue is full."""
+        rec = {k: None for k in RECORD_FIELDS}
+        rec.update(fields, ts=datetime.now(timezone.utc).isoformat(timespec="milliseconds"), kind=kind, call=call)
+        if rec["detail"] is not None:
+            rec["detail"] = str(rec["detail"])[:MAX_DETAIL_CHARS]
+        try:
+            self._queue.put_nowait(rec)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Block until every queued record is on disk (or `timeout` elapses)."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return not self._queue.unfinished_tasks
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5.0)
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=self.flush_interval_s)
+            except queue.Empty:
+                continue
+            batch = [first]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            records = [r for r in batch if r is not None]
+            try:
+                if records:
+                    self._write(records)
+            except Exception as e:
+                logger.warning(f"⚠️ Audit log write failed ({len(records)} records lost): {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def _write(self, records):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        data = "".join(json.dumps(r, default=str) + "\n" for r in records)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(data)
+        if os.path.getsize(self.path) >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        if self.parquet_dir:
+            segment = f"{self.path}.{time.time_ns()}"
+            os.replace(self.path, segment)
+            self._compact(segment)
+            return
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def _compact(self, segment: str):
+        """Convert a rotated JSON-lines segment into a ZSTD Parquet file and drop the segment.
+
+        The columns are read with RECORD_TYPES rather than sniffed, so every Parquet file has the
+        same schema even when a segment holds only NULLs for some field.
+        """
+        import duckdb
+        os.makedirs(self.parquet_dir, exist_ok=True)
+        name = os.path.basename(segment).replace(".", "-") + ".parquet"
+        target = os.path.join(self.parquet_dir, name)
+        columns = "{" + ", ".join(f"'{k}': '{t}'" for k, t in RECORD_TYPES.items()) + "}"
+        con = duckdb.connect()
+        try:
+            con.execute(
+                f"COPY (SELECT * FROM read_json('{segment}', format='newline_delimited', columns={columns})) "
+                f"TO '{target}' (FORMAT PARQUET, COMPRESSION ZSTD)"
+            )
+        finally:
+            con.close()
+        os.remove(segment)
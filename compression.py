@@ -0,0 +1,190 @@
+"""
+Response Compression for DCL
+Pure ASGI middleware that gzip- or brotli-encodes responses above a size
+threshold. Streamed responses are compressed chunk by chunk and flushed as
+they go, so NDJSON/Arrow streams keep arriving incrementally.
+"""
+
+import zlib
+from typing import Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli  # Optional: enables Content-Encoding "br" when installed
+except ImportError:
+    brotli = None
+
+# Suffix added to a strong ETag when the body is re-encoded (RFC 9110 8.8.3)
+ETAG_SUFFIXES = {"gzip": "-gzip", "br": "-br"}
+
+
+def strip_etag_encoding(tag: str) -> str:
+    """Map an ETag sent back by a client to the identity-encoding ETag it was derived from."""
+    tag = tag.strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    for suffix in ETAG_SUFFIXES.values():
+        if tag.endswith(suffix + '"'):
+            return tag[:-len(suffix) - 1] + '"'
+    return tag
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """True if an If-None-Match header value matches `etag` (any content encoding)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(strip_etag_encoding(t) == etag for t in if_none_match.split(","))
+
+
+class _Encoder:
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._c = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._c = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)  # wbits 31 -> gzip container
+
+    def chunk(self, data: bytes, final: bool) -> bytes:
+        if self.encoding == "br":
+            out = self._c.process(data)
+            return out + (self._c.finish() if final else self._c.flush())
+        out = self._c.compress(data)
+        return out + self._c.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class CompressionMiddleware:
+    """
+    Compress responses for clients that accept gzip (or br, if `brotli` is installed).
+
+    Complete bodies smaller than `minimum_size` bytes, responses that already carry a
+    Content-Encoding, bodiless statuses and excluded media types are passed through.
+    Every response of a non-excluded media type carries `Vary: Accept-Encoding`, even
+    when it is sent uncompressed, so shared caches keep the encodings apart.
+    """
+
+    def __init__(self, app,
+                 minimum_size: int = 1024,
+                 gzip_level: int = 6,
+                 brotli_quality: int = 4,
+                 exclude_media_types: Tuple[str, ...] = ("text/event-stream",)):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.exclude_media_types = exclude_media_types
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = self._negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            async def vary_send(message):
+                if message["type"] == "http.response.start":
+                    self._add_vary(message)
+                await send(message)
+            await self.app(scope, receive, vary_send)
+            return
+        if_none_match = Headers(scope=scope).get("if-none-match", "")
+        await self.app(scope, receive, _CompressingSend(self, send, encoding, if_none_match))
+
+    def _add_vary(self, start):
+        """Add `Vary: Accept-Encoding` to a response start message of a compressible media type."""
+        headers = MutableHeaders(scope=start)
+        if headers.get("content-type", "").split(";")[0].strip() not in self.exclude_media_types:
+            headers.add_vary_header("Accept-Encoding")
+
+    def _negotiate(self, accept_encoding: str) -> Optional[str]:
+        accepted = set()
+        for part in accept_encoding.lower().split(","):
+            name, _, params = part.strip().partition(";")
+            q = params.strip()
+            if q.startswith("q="):
+                try:
+                    if float(q[2:]) == 0:
+                        continue
+                except ValueError:
+                    continue
+            accepted.add(name.strip())
+        if brotli is not None and "br" in accepted:
+            return "br"
+        if "gzip" in accepted:
+            return "gzip"
+        return None
+
+
+class _CompressingSend:
+    """ASGI `send` wrapper that buffers up to `minimum_size` bytes, then decides whether to compress.
+
+    Buffering matters because inner middleware may re-stream even small bodies in chunks.
+    """
+
+    def __init__(self, mw: CompressionMiddleware, send, encoding: str, if_none_match: str):
+        self.mw = mw
+        self.send = send
+        self.encoding = encoding
+        self.if_none_match = if_none_match
+        self.start = None
+        self.buffer = b""
+        self.encoder: Optional[_Encoder] = None
+        self.passthrough = False
+
+    async def __call__(self, message):
+        kind = message["type"]
+        if kind == "http.response.start":
+            self.start = message
+            self.mw._add_vary(message)
+            if message.get("status") == 304:
+                self._tag_not_modified()
+            return
+        if kind != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        more = message.get("more_body", False)
+        if self.encoder is None:
+            body = self.buffer + message.get("body", b"")
+            if more and len(body) < self.mw.minimum_size and self._compressible():
+                self.buffer = body
+                return
+            self.buffer = b""
+            if not self._compressible() or (not more and len(body) < self.mw.minimum_size):
+                self.passthrough = True
+                await self.send(self.start)
+                await self.send({"type": "http.response.body", "body": body, "more_body": more})
+                return
+            self.encoder = _Encoder(self.encoding, self.mw.gzip_level, self.mw.brotli_quality)
+            headers = MutableHeaders(scope=self.start)
+            headers["Content-Encoding"] = self.encoding
+            etag = headers.get("etag")
+            if etag and etag.endswith('"'):
+                headers["ETag"] = etag[:-1] + ETAG_SUFFIXES[self.encoding] + '"'
+            data = self.encoder.chunk(body, final=not more)
+            if more:
+                del headers["Content-Length"]
+            else:
+                headers["Content-Length"] = str(len(data))
+            await self.send(self.start)
+            await self.send({"type": "http.response.body", "body": data, "more_body": more})
+            return
+
+        data = self.encoder.chunk(message.get("body", b""), final=not more)
+        await self.send({"type": "http.response.body", "body": data, "more_body": more})
+
+    def _compressible(self) -> bool:
+        headers = Headers(raw=self.start.get("headers", []))
+        if self.start.get("status", 200) in (204, 304) or "content-encoding" in headers:
+            return False
+        return headers.get("content-type", "").split(";")[0].strip() not in self.mw.exclude_media_types
+
+    def _tag_not_modified(self):
+        # A 304 must carry the ETag of the (compressed) representation the client validated
+        headers = MutableHeaders(scope=self.start)
+        etag = headers.get("etag")
+        if etag and etag.endswith('"'):
+            encoded = etag[:-1] + ETAG_SUFFIXES[self.encoding] + '"'
+            if encoded in self.if_none_match:
+                headers["ETag"] = encoded
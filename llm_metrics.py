@@ -0,0 +1,186 @@
+"""
+LLM Call Metrics for DCL
+Per-call token/latency accounting with streaming percentile histograms,
+rendered in Prometheus text exposition format.
+"""
+
+import math
+import threading
+from typing import Any, Dict, List, Tuple
+
+QUANTILES = (0.5, 0.95, 0.99)
+OUTCOMES = ("ok", "parse_error", "error")
+
+
+class StreamingHistogram:
+    """
+    Fixed-memory histogram with geometrically spaced buckets.
+    Quantiles are estimated by interpolating inside the bucket that holds the
+    requested rank, so relative error is bounded by the bucket growth factor.
+    """
+
+    def __init__(self, lo: float, hi: float, growth: float = 1.15):
+        bounds = []
+        b = lo
+        while b < hi:
+            bounds.append(b)
+            b *= growth
+        bounds.append(hi)
+        self.bounds: List[float] = bounds
+        self.counts: List[int] = [0] * (len(bounds) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def observe(self, value: float):
+        value = max(0.0, float(value))
+        lo, hi = 0, len(self.bounds)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if value <= self.bounds[mid]:
+                hi = mid
+            else:
+                lo = mid + 1
+        self.counts[lo] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        if self.count == 0:
+            return math.nan
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            if c and seen + c >= rank:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else self.max
+                lower, upper = max(lower, self.min), min(upper, self.max)
+                return lower + (upper - lower) * ((rank - seen) / c)
+            seen += c
+        return self.max
+
+
+class LLMMetrics:
+    """
+    Thread-safe registry of LLM call metrics.
+    Series are keyed by (call, model); calls are additionally split by outcome
+    and cache hit so error rates and cache effectiveness can be derived.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Tuple[str, str, str, bool], int] = {}
+        self._tokens: Dict[Tuple[str, str, str], int] = {}
+        self._latency: Dict[Tuple[str, str], StreamingHistogram] = {}
+        self._call_tokens: Dict[Tuple[str, str], StreamingHistogram] = {}
+
+    def record(self,
+               call: str,
+               model: str,
+               latency_s: float,
+               prompt_tokens: int = 0,
+               completion_tokens: int = 0,
+               outcome: str = "ok",
+               cache_hit: bool = False):
+        """
+        Record a single LLM call.
+
+        Args:
+            call: Logical call site (e.g. "plan", "validate", "infer")
+            model: Model name the request was sent to
+            latency_s: Wall-clock latency in seconds
+            prompt_tokens: Prompt tokens reported by the provider
+            completion_tokens: Completion tokens reported by the provider
+            outcome: One of "ok", "parse_error", "error"
+            cache_hit: True when the result was served from a cache
+        """
+        if outcome not in OUTCOMES:
+            outcome = "error"
+        series = (call, model)
+        with self._lock:
+            key = (call, model, outcome, bool(cache_hit))
+            self._calls[key] = self._calls.get(key, 0) + 1
+            if cache_hit:
+                return
+            for kind, n in (("prompt", prompt_tokens), ("completion", completion_tokens)):
+                tkey = (call, model, kind)
+                self._tokens[tkey] = self._tokens.get(tkey, 0) + int(n or 0)
+            if series not in self._latency:
+                self._latency[series] = StreamingHistogram(0.001, 300.0)
+                self._call_tokens[series] = StreamingHistogram(1.0, 2_000_000.0)
+            self._latency[series].observe(latency_s)
+            self._call_tokens[series].observe((prompt_tokens or 0) + (completion_tokens or 0))
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return a JSON-friendly summary of all series."""
+        with self._lock:
+            latency = {
+                f"{call}/{model}": {
+                    "count": h.count,
+                    **{f"p{int(q * 100)}": round(h.quantile(q), 4) for q in QUANTILES},
+                }
+                for (call, model), h in self._latency.items()
+            }
+            return {
+                "calls": sum(self._calls.values()),
+                "tokens": sum(self._tokens.values()),
+                "latency_s": latency,
+            }
+
+    def render_prometheus(self) -> str:
+        """Render all series in Prometheus text exposition format (version 0.0.4)."""
+        lines: List[str] = []
+        with self._lock:
+            lines.append("# HELP dcl_llm_calls_total LLM calls by call site, model, outcome and cache hit.")
+            lines.append("# TYPE dcl_llm_calls_total counter")
+            for (call, model, outcome, hit), n in sorted(self._calls.items()):
+                lines.append(f"dcl_llm_calls_total{_labels(call=call, model=model, outcome=outcome, cache_hit=str(hit).lower())} {n}")
+
+            lines.append("# HELP dcl_llm_tokens_total Tokens reported by the provider, by kind.")
+            lines.append("# TYPE dcl_llm_tokens_total counter")
+            for (call, model, kind), n in sorted(self._tokens.items()):
+                lines.append(f"dcl_llm_tokens_total{_labels(call=call, model=model, kind=kind)} {n}")
+
+            _render_summary(lines, "dcl_llm_latency_seconds", "LLM call latency in seconds.", self._latency)
+            _render_summary(lines, "dcl_llm_call_tokens", "Total tokens per LLM call.", self._call_tokens)
+        return "\n".join(lines) + "\n"
+
+
+def usage_from_response(resp: Any) -> Tuple[int, int]:
+    """Extract (prompt_tokens, completion_tokens) from a Gemini response's usage_metadata."""
+    usage = getattr(resp, "usage_metadata", None)
+    if usage is None:
+        return 0, 0
+    prompt = getattr(usage, "prompt_token_count", 0) or 0
+    completion = getattr(usage, "candidates_token_count", 0) or 0
+    return int(prompt), int(completion)
+
+
+def _labels(**labels: str) -> str:
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+    return "{" + body + "}"
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _render_summary(lines: List[str], name: str, help_text: str,
+                    series: Dict[Tuple[str, str], StreamingHistogram]):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} summary")
+    for (call, model), h in sorted(series.items()):
+        for q in QUANTILES:
+            value = h.quantile(q)
+            lines.append(f"{name}{_labels(call=call, model=model, quantile=str(q))} {_fmt(value)}")
+        lines.append(f"{name}_sum{_labels(call=call, model=model)} {_fmt(h.sum)}")
+        lines.append(f"{name}_count{_labels(call=call, model=model)} {h.count}")
+
+
+def _fmt(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    return repr(round(value, 6))
@@ -0,0 +1,162 @@
+"""
+State Store for DCL
+Versioned key/value storage for the demo's shared state (graph, connected
+sources, schemas, selected agents, mode flags, counters). The in-process store
+keeps plain references for a single worker; the SQLite store (WAL mode) lets
+several uvicorn worker processes share one copy of the state.
+"""
+
+import json
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+
+class MemoryStateStore:
+    """
+    Single-process store. Values are kept by reference, so saving costs nothing
+    beyond bumping the key's version.
+    """
+
+    shared = False
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:8]
+        self._lock = threading.RLock()
+        self._seq = 0
+        self._values: Dict[str, Any] = {}
+        self._versions: Dict[str, int] = {}
+
+    def write_lock(self):
+        """Serialize read-modify-write sections (re-entrant)."""
+        return self._lock
+
+    def get(self, key: str) -> Optional[Tuple[int, Any]]:
+        with self._lock:
+            if key not in self._versions:
+                return None
+            return self._versions[key], self._values[key]
+
+    def changed(self, keys: Iterable[str], known: Dict[str, int]) -> Dict[str, Tuple[int, Any]]:
+        """(version, value) for each of `keys` whose version differs from `known`."""
+        with self._lock:
+            return {k: (self._versions[k], self._values[k]) for k in keys
+                    if k in self._versions and self._versions[k] != known.get(k)}
+
+    def save(self, values: Dict[str, Any]) -> Dict[str, int]:
+        """Store `values` and return their new versions."""
+        with self._lock:
+            for key, value in values.items():
+                self._seq += 1
+                self._values[key] = value
+                self._versions[key] = self._seq
+            return {k: self._versions[k] for k in values}
+
+    def delete(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self._values.pop(key, None)
+                self._versions.pop(key, None)
+
+    def close(self):
+        pass
+
+
+class SQLiteStateStore:
+    """
+    Store shared by every process that opens the same SQLite file.
+
+    Values are JSON. Versions come from one store-wide sequence, so a key that is
+    deleted and written again never reuses a version another worker has seen.
+    `write_lock()` holds a `BEGIN IMMEDIATE` transaction, which excludes writers in
+    other processes until it commits.
+    """
+
+    shared = True
+
+    def __init__(self, path: str, timeout_s: float = 30.0):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._con = sqlite3.connect(path, timeout=timeout_s, isolation_level=None, check_same_thread=False)
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.execute("PRAGMA synchronous=NORMAL")
+        with self.write_lock():
+            self._con.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, version INTEGER NOT NULL, value TEXT NOT NULL)")
+            self._con.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._con.execute("INSERT OR IGNORE INTO meta VALUES ('id', ?), ('seq', '0')", [uuid.uuid4().hex[:8]])
+        self.id = self._con.execute("SELECT value FROM meta WHERE key = 'id'").fetchone()[0]
+
+    @contextmanager
+    def write_lock(self):
+        with self._lock:
+            outer = self._depth == 0
+            if outer:
+                self._con.execute("BEGIN IMMEDIATE")
+            self._depth += 1
+            try:
+                yield
+            except BaseException:
+                self._depth -= 1
+                if outer:
+                    self._con.execute("ROLLBACK")
+                raise
+            self._depth -= 1
+            if outer:
+                self._con.execute("COMMIT")
+
+    def get(self, key: str) -> Optional[Tuple[int, Any]]:
+        with self._lock:
+            row = self._con.execute("SELECT version, value FROM state WHERE key = ?", [key]).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def changed(self, keys: Iterable[str], known: Dict[str, int]) -> Dict[str, Tuple[int, Any]]:
+        """(version, value) for each of `keys` whose version differs from `known`.
+
+        Versions are compared first, so values are only read and decoded for keys that changed.
+        """
+        keys = list(keys)
+        marks = ",".join("?" * len(keys))
+        with self._lock:
+            versions = self._con.execute(f"SELECT key, version FROM state WHERE key IN ({marks})", keys).fetchall()
+            stale = [k for k, v in versions if known.get(k) != v]
+            if not stale:
+                return {}
+            marks = ",".join("?" * len(stale))
+            rows = self._con.execute(f"SELECT key, version, value FROM state WHERE key IN ({marks})", stale).fetchall()
+        return {k: (v, json.loads(value)) for k, v, value in rows}
+
+    def save(self, values: Dict[str, Any]) -> Dict[str, int]:
+        """Store `values` and return their new versions."""
+        encoded = {k: json.dumps(v, default=str) for k, v in values.items()}
+        versions = {}
+        with self.write_lock():
+            seq = int(self._con.execute("SELECT value FROM meta WHERE key = 'seq'").fetchone()[0])
+            for key, value in encoded.items():
+                seq += 1
+                self._con.execute("INSERT OR REPLACE INTO state VALUES (?, ?, ?)", [key, seq, value])
+                versions[key] = seq
+            self._con.execute("UPDATE meta SET value = ? WHERE key = 'seq'", [str(seq)])
+        return versions
+
+    def delete(self, *keys: str):
+        with self.write_lock():
+            self._con.executemany("DELETE FROM state WHERE key = ?", [[k] for k in keys])
+
+    def close(self):
+        with self._lock:
+            self._con.close()
+
+
+def open_state_store(url: str):
+    """Open a store from a STATE_STORE setting: "memory", or "sqlite:<path>"."""
+    if url in ("", "memory"):
+        return MemoryStateStore()
+    if url.startswith("sqlite:"):
+        path = url[len("sqlite:"):]
+        if path.startswith("//"):
+            path = path[2:]
+        return SQLiteStateStore(path)
+    raise ValueError(f"Unknown STATE_STORE '{url}' (expected 'memory' or 'sqlite:<path>')")
@@ -1,9 +1,18 @@
-let state = {events: [], timeline: [], graph: {nodes:[], edges:[], confidence:null, last_updated:null}, preview:{sources:{}, ontology:{}}, llm:{calls:0, tokens:0}, auto_ingest_unmapped:false};
+let events = [];
+let eventsSeq = 0;
+let state = {graph: {nodes:[], edges:[], confidence:null, last_updated:null}, preview:{sources:{}, ontology:{}}, llm:{calls:0, tokens:0}, auto_ingest_unmapped:false};
 
 async function refreshState() {
   const res = await fetch("/state");
   state = await res.json();
   console.log("Fetched state:", state);
+  if (state.events_seq !== eventsSeq) {
+    // /state only reports the journal cursor; fetch the events after it (all of them if the server restarted)
+    const restarted = state.events_seq < eventsSeq;
+    const ev = await (await fetch(`/events?after=${restarted ? 0 : eventsSeq}`)).json();
+    events = (restarted ? [] : events.filter(e => e.seq >= ev.first_seq)).concat(ev.events);
+    eventsSeq = ev.last_seq;
+  }
   renderLog();
   renderGraph();
   renderPreviews();
@@ -11,7 +20,7 @@ async function refreshState() {
 
 function renderLog(){
   const logEl = document.getElementById('log');
-  logEl.textContent = state.events.join("\n");
+  logEl.textContent = events.map(e => e.msg).join("\n");
   const conf = state.graph.confidence;
   const statusBadge = document.getElementById('statusBadge');
   const confText = conf != null ? `${Math.round(conf*100)}%` : '--';
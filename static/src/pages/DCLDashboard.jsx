@@ -23,7 +23,6 @@ function TypingText({ text, speed = 30 }) {
 
 function DCLDashboard(){
   const [state, setState] = React.useState({
-    events: [],
     graph: {nodes: [], edges: []},
     llm: {calls: 0, tokens: 0},
     preview: {sources: {}, ontology: {}, connectionInfo: null},
@@ -35,9 +34,11 @@ function DCLDashboard(){
   const [selectedAgents, setSelectedAgents] = React.useState([]);
   const [processState, setProcessState] = React.useState({ active: false, stage: '', progress: 0, complete: false });
   const [showHookModal, setShowHookModal] = React.useState(false);
+  const [events, setEvents] = React.useState([]);
   const [typingEvents, setTypingEvents] = React.useState([]);
   
   const modalButtonRef = React.useRef(null);
+  const eventsSeqRef = React.useRef(0);
   const processTimeoutRef = React.useRef(null);
 
   // Handle modal accessibility: Escape key and focus trap
@@ -102,6 +103,7 @@ function DCLDashboard(){
       const res = await fetch('/state');
       const data = await res.json();
       setState(data);
+      syncEvents(data.events_seq);
       // Sync local selections with backend on initial load only
       setSelectedSources(data.selected_sources || []);
       setSelectedAgents(data.selected_agents || []);
@@ -129,26 +131,14 @@ function DCLDashboard(){
     return () => window.removeEventListener('sankey-node-click', handleSankeyNodeClick);
   }, []);
 
-  // Track new events and animate them with typing effect
+  // Animate new events with typing effect
   React.useEffect(() => {
-    // Check if events changed (length or content)
-    const eventsChanged = state.events.length !== typingEvents.length || 
-      state.events.some((event, idx) => typingEvents[idx]?.text !== event);
-    
-    if (eventsChanged) {
-      if (state.events.length === 0) {
-        // Events were cleared
-        setTypingEvents([]);
-      } else {
-        // New events or content changed - update and mark latest for typing
-        setTypingEvents(state.events.map((event, idx) => ({
-          text: event,
-          isTyping: idx === state.events.length - 1, // Only the latest event types
-          key: `${idx}-${event.substring(0, 20)}-${Date.now()}` // Unique key with timestamp
-        })));
-      }
-    }
-  }, [state.events, typingEvents]);
+    setTypingEvents(events.map((event, idx) => ({
+      text: event.msg,
+      isTyping: idx === events.length - 1, // Only the latest event types
+      key: event.seq
+    })));
+  }, [events]);
 
   // Cleanup timeout on unmount to prevent React warnings
   React.useEffect(() => {
@@ -159,9 +149,26 @@ function DCLDashboard(){
     };
   }, []);
 
+  // Fetch only the journal events newer than the last one seen; /state just reports the latest sequence id
+  async function syncEvents(seq){
+    if (seq === eventsSeqRef.current) return;
+    // A lower sequence id means the server restarted, so start over
+    const after = seq < eventsSeqRef.current ? 0 : eventsSeqRef.current;
+    const res = await fetch(`/events?after=${after}`);
+    const data = await res.json();
+    eventsSeqRef.current = data.last_seq;
+    setEvents(prev => {
+      // Events older than first_seq were evicted or cleared by a reset on the server
+      const kept = after === 0 ? [] : prev.filter(e => e.seq >= data.first_seq);
+      const lastSeq = kept.length ? kept[kept.length - 1].seq : 0;
+      return kept.concat(data.events.filter(e => e.seq > lastSeq));
+    });
+  }
+
   async function fetchState(){
     const res = await fetch('/state');
     const data = await res.json();
+    syncEvents(data.events_seq);
     setState(prev => {
       const hasConnectionInfo = prev.preview.connectionInfo !== null && prev.preview.connectionInfo !== undefined;
       return {
@@ -198,10 +205,27 @@ function DCLDashboard(){
       const sourcesParam = selectedSources.join(',');
       const agentsParam = selectedAgents.join(',');
       const res = await fetch(`/connect?sources=${sourcesParam}&agents=${agentsParam}`);
-      setProcessState({ active: true, stage: 'Mapping fields to ontology...', progress: 70, complete: false });
+      const { job_id } = await res.json();
       
-      await res.json();
-      setProcessState({ active: true, stage: 'Validating mappings...', progress: 90, complete: false });
+      // Connect runs as a background job; follow its per-source stages until it finishes
+      const stageLabels = {
+        snapshot: ['Analyzing schema structure...', 40],
+        plan: ['Mapping fields to ontology...', 70],
+        validate: ['Validating mappings...', 85],
+        publish: ['Publishing unified views...', 95]
+      };
+      while (job_id) {
+        const job = await (await fetch(`/jobs/${job_id}`)).json();
+        if (job.error || job.status === 'done' || job.status === 'error') break;
+        const stages = Object.values(job.sources || {}).map(t => t.stage).filter(Boolean);
+        const slowest = ['snapshot', 'plan', 'validate', 'publish'].find(s => stages.includes(s));
+        if (slowest) {
+          const [label, progress] = stageLabels[slowest];
+          setProcessState({ active: true, stage: label, progress, complete: false });
+        }
+        await fetchState();
+        await new Promise(resolve => setTimeout(resolve, 500));
+      }
       
       await fetchState();
       setProcessState({ active: true, stage: 'Completed successfully', progress: 100, complete: true });
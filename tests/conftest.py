@@ -0,0 +1,29 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TMP = tempfile.mkdtemp(prefix="dcl-tests-")
+
+# app.py resolves schemas/, ontology/ and agents/ relative to the working directory
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+os.environ.setdefault("AUDIT_LOG_PATH", os.path.join(TMP, "logs", "llm_audit.jsonl"))
+
+import app as dcl  # noqa: E402
+
+# Keep the tests away from the checked-in registry.duckdb
+dcl.DB_PATH = os.path.join(TMP, "registry.duckdb")
+dcl.PARQUET_CACHE_DIR = os.path.join(TMP, "parquet_cache")
+
+
+@pytest.fixture
+def app_module():
+    return dcl
+
+
+@pytest.fixture
+def tmp_dir():
+    return TMP
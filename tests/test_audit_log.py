@@ -0,0 +1,44 @@
+import json
+import queue
+import threading
+
+import duckdb
+
+import audit_log
+
+
+def test_compacted_segments_share_one_schema(tmp_path):
+    log = audit_log.AuditLog(str(tmp_path / "audit.jsonl"), max_bytes=1, parquet_dir=str(tmp_path / "pq"))
+    try:
+        # One segment with every field set, one where most fields are NULL
+        log.record("llm", "plan", model="m", source="sap", prompt_sha1="ab", latency_s=0.5,
+                   prompt_tokens=10, completion_tokens=3, outcome="ok", cache_hit=False, detail={"x": 1})
+        assert log.flush()
+        log.record("rag", "search")
+        assert log.flush()
+    finally:
+        log.close()
+
+    files = sorted((tmp_path / "pq").glob("*.parquet"))
+    assert len(files) == 2
+    con = duckdb.connect()
+    schemas = [con.sql(f"DESCRIBE SELECT * FROM '{f}'").fetchall() for f in files]
+    assert schemas[0] == schemas[1]
+    assert [(name, typ) for name, typ, *_ in schemas[0]] == list(audit_log.RECORD_TYPES.items())
+    rows = con.sql(f"SELECT kind, prompt_tokens, cache_hit, detail FROM read_parquet({json.dumps([str(f) for f in files])}) "
+                   "ORDER BY kind").fetchall()
+    assert rows == [("llm", 10, False, "{'x': 1}"), ("rag", None, None, None)]
+
+
+def test_dropped_records_are_counted_across_threads(tmp_path):
+    log = audit_log.AuditLog(str(tmp_path / "audit.jsonl"))
+    log.close()
+    log._queue = queue.Queue(1)
+    log._queue.put_nowait(None)  # Nothing drains it any more, so every record is dropped
+
+    threads = [threading.Thread(target=lambda: [log.record("llm", "plan") for _ in range(2000)]) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert log.dropped == 16000
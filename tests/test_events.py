@@ -0,0 +1,28 @@
+from fastapi.testclient import TestClient
+
+import app as dcl
+
+
+def test_state_reports_only_the_event_cursor():
+    client = TestClient(dcl.app)
+    dcl.log("first event for the cursor test")
+    state = client.get("/state").json()
+    assert "events" not in state
+    assert state["events_seq"] == dcl.EVENT_LOG.last_seq
+
+    dcl.log("second event for the cursor test")
+    page = client.get(f"/events?after={state['events_seq']}").json()
+    assert [e["msg"] for e in page["events"]] == ["second event for the cursor test"]
+    assert page["last_seq"] == state["events_seq"] + 1
+
+
+def test_first_seq_tracks_eviction_and_clear():
+    journal = dcl.EventJournal(2)
+    assert journal.first_seq == 1
+    for msg in ("a", "b", "c"):
+        journal.append(msg)
+    assert journal.first_seq == 2 and [e["msg"] for e in journal.since(0)] == ["b", "c"]
+    journal.clear()
+    assert journal.first_seq == 4 and journal.since(0) == []
+    journal.append("d")
+    assert journal.first_seq == 4 and journal.since(3) == [{"seq": 4, "msg": "d"}]
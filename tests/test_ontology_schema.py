@@ -0,0 +1,22 @@
+import shutil
+
+from fastapi.testclient import TestClient
+
+import app as dcl
+
+
+def test_etag_changes_when_the_ontology_file_changes(tmp_path, monkeypatch):
+    path = tmp_path / "catalog.yml"
+    shutil.copy(dcl.ONTOLOGY_PATH, path)
+    monkeypatch.setattr(dcl, "ONTOLOGY_PATH", str(path))
+    client = TestClient(dcl.app)
+
+    first = client.get("/ontology_schema")
+    etag = first.headers["etag"]
+    assert client.get("/ontology_schema", headers={"If-None-Match": etag}).status_code == 304
+
+    path.write_text(path.read_text().replace("account_name", "account_title", 1))
+    changed = client.get("/ontology_schema", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert "account_title" in changed.json()["account"]["fields"]
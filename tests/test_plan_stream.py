@@ -0,0 +1,104 @@
+import json
+
+import pytest
+
+import app as dcl
+
+ACCOUNT = {"entity": "account", "source_table": "accounts",
+           "fields": [{"source": "Id", "onto_field": "account_id", "confidence": 0.9}]}
+OPPORTUNITY = {"entity": "opportunity", "source_table": "opps",
+               "fields": [{"source": "Name", "onto_field": "opportunity_name", "confidence": 0.8}]}
+
+
+def stream(text, size):
+    seen = []
+    parser = dcl.PlanStreamParser(seen.append)
+    for i in range(0, len(text), size):
+        parser.feed(text[i:i + size])
+    return parser, seen
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1000])
+def test_mappings_split_across_chunks(size):
+    text = json.dumps({"mappings": [ACCOUNT, OPPORTUNITY], "joins": [{"left": "a.id", "right": "b.id"}]})
+    parser, seen = stream(text, size)
+    assert seen == [ACCOUNT, OPPORTUNITY]
+    assert parser.result()["joins"] == [{"left": "a.id", "right": "b.id"}]
+
+
+def test_escaped_quotes_and_braces_inside_strings():
+    tricky = {"entity": "account", "source_table": "accounts",
+              "fields": [{"source": 'Na\\"me}]', "onto_field": "account_name", "transform": 'say "{hi}" \\'}]}
+    text = '```json\n' + json.dumps({"mappings": [tricky, ACCOUNT]}) + '\n```'
+    parser, seen = stream(text, 1)
+    assert seen == [tricky, ACCOUNT]
+    assert parser.result()["mappings"] == [tricky, ACCOUNT]
+
+
+def test_mappings_key_inside_a_mapping_is_not_top_level():
+    nested = {"entity": "account", "source_table": "t", "fields": [], "meta": {"mappings": [{"x": 1}]}}
+    _, seen = stream(json.dumps({"mappings": [nested]}), 5)
+    assert seen == [nested]
+
+
+def test_truncated_stream_keeps_complete_mappings():
+    text = json.dumps({"mappings": [ACCOUNT, OPPORTUNITY]})
+    parser, seen = stream(text[:text.index('"opps"')], 4)
+    assert seen == [ACCOUNT]
+    with pytest.raises(ValueError):
+        parser.result()
+
+
+def test_invalid_stream():
+    parser, seen = stream('Sorry, I cannot produce a plan for {these tables}.', 3)
+    assert seen == []
+    with pytest.raises(ValueError):
+        parser.result()
+
+
+def test_invalid_mapping_is_skipped():
+    parser, seen = stream('{"mappings": [{"entity": nope}, ' + json.dumps(ACCOUNT) + ']}', 2)
+    assert seen == [ACCOUNT]
+
+
+@pytest.fixture
+def ws(monkeypatch):
+    monkeypatch.setattr(dcl, "ontology", dcl.load_ontology())
+    return dcl.Workspace(id="0123456789abcdef")
+
+
+def test_fallback_retracts_streamed_nodes_and_edges(ws):
+    streamed = dcl.StreamedMappings()
+    dcl.publish_streamed_mapping(ws, "t", streamed, "accounts", ACCOUNT)
+    dcl.publish_streamed_mapping(ws, "t", streamed, "opps", OPPORTUNITY)
+    assert {n["id"] for n in ws.graph["nodes"]} == {"dcl_account", "dcl_opportunity"}
+    assert len(ws.graph["edges"]) == 2
+
+    # The opps shard failed and fell back to a different heuristic mapping
+    heuristic = {**OPPORTUNITY, "fields": [{"source": "Id", "onto_field": "opportunity_id", "confidence": 0.6}]}
+    plan = {"mappings": [ACCOUNT, heuristic], "shards": ["accounts"]}
+    dcl.retract_streamed_mappings(ws, streamed, plan)
+    assert [n["id"] for n in ws.graph["nodes"]] == ["dcl_account"]
+    assert [e["target"] for e in ws.graph["edges"]] == ["dcl_account"]
+    assert streamed.prebuilt(ACCOUNT)["edge"]["target"] == "dcl_account"
+    assert streamed.prebuilt(heuristic) is None
+
+
+def test_mapping_from_a_failed_shard_is_not_reused(ws):
+    streamed = dcl.StreamedMappings()
+    dcl.publish_streamed_mapping(ws, "t", streamed, "accounts", ACCOUNT)
+    # A heuristic mapping identical to the streamed one still does not reuse it
+    dcl.retract_streamed_mappings(ws, streamed, {"mappings": [ACCOUNT]})
+    assert streamed.prebuilt(ACCOUNT) is None
+    assert ws.graph["edges"] == [] and ws.graph["nodes"] == []
+
+
+def test_rollback_retracts_everything_but_existing_nodes(ws):
+    ws.graph["nodes"].append({"id": "dcl_account", "label": "Account (Unified)", "type": "ontology"})
+    streamed = dcl.StreamedMappings()
+    dcl.publish_streamed_mapping(ws, "t", streamed, "accounts,opps", ACCOUNT)
+    dcl.publish_streamed_mapping(ws, "t", streamed, "accounts,opps", OPPORTUNITY)
+    dcl.retract_streamed_mappings(ws, streamed)
+    assert [n["id"] for n in ws.graph["nodes"]] == ["dcl_account"]
+    assert ws.graph["edges"] == []
+    assert streamed.built == {}
@@ -0,0 +1,81 @@
+import json
+
+import pyarrow as pa
+import pytest
+from fastapi.testclient import TestClient
+
+import app as dcl
+
+SESSION = "00000000000000aa"
+HEADERS = {"X-DCL-Session": SESSION}
+
+
+@pytest.fixture(scope="module")
+def client():
+    ws = dcl.get_workspace(SESSION)
+    assert dcl.connect_source("salesforce", ws)["ok"]
+    return TestClient(dcl.app)
+
+
+def expected(sql):
+    con = dcl.workspace_connect(dcl.get_workspace(SESSION))
+    try:
+        return con.sql(sql).fetchall()
+    finally:
+        con.close()
+
+
+def test_ndjson_rows(client):
+    r = client.get("/query/account?columns=account_id,account_name&order_by=-account_id&limit=2", headers=HEADERS)
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in r.text.splitlines()]
+    assert [tuple(row.values()) for row in rows] == expected(
+        "SELECT account_id, account_name FROM dcl_account ORDER BY account_id DESC LIMIT 2")
+    assert all(list(row) == ["account_id", "account_name"] for row in rows)
+
+
+def test_arrow_stream_with_filters(client):
+    first, revenue = expected("SELECT account_id, revenue FROM dcl_account WHERE revenue IS NOT NULL "
+                              "ORDER BY account_id LIMIT 1")[0]
+    r = client.get(f"/query/account?format=arrow&filter=account_id:in:{first}|nope&filter=revenue:gte:{revenue}"
+                   "&filter=created_date:notnull:", headers=HEADERS)
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "application/vnd.apache.arrow.stream"
+    table = pa.ipc.open_stream(r.content).read_all()
+    assert table.column_names == [c for (c, *_) in expected("DESCRIBE dcl_account") if c != "_dcl_source"]
+    assert table.column("account_id").to_pylist() == [a for (a,) in expected(
+        f"SELECT account_id FROM dcl_account WHERE account_id = '{first}' AND created_date IS NOT NULL")]
+    assert table.schema.field("revenue").type == pa.float64()
+
+
+def test_limit_is_capped(client, monkeypatch):
+    monkeypatch.setattr(dcl, "QUERY_MAX_ROWS", 1)
+    r = client.get("/query/account?limit=50", headers=HEADERS)
+    assert len(r.text.splitlines()) == 1
+
+
+@pytest.mark.parametrize("query, error", [
+    ("filter=revenue:gt:abc", "invalid value 'abc' for column revenue (DOUBLE)"),
+    ("filter=revenue:in:1|x", "invalid value 'x' for column revenue (DOUBLE)"),
+    ("filter=created_date:eq:yesterday", "invalid value 'yesterday' for column created_date (DATE)"),
+    ("filter=revenue:between:1", "Unknown filter operator 'between'"),
+    ("columns=account_id,nope", "Unknown column 'nope' for account"),
+    ("order_by=-nope", "Unknown column 'nope' for account"),
+])
+def test_bad_requests(client, query, error):
+    r = client.get(f"/query/account?{query}", headers=HEADERS)
+    assert r.status_code == 400
+    assert r.json()["error"].startswith(error)
+
+
+def test_like_filter_accepts_any_text(client):
+    r = client.get("/query/account?filter=revenue:like:%25abc%25", headers=HEADERS)
+    assert r.status_code == 200 and r.text == ""
+
+
+def test_unknown_format_and_entity(client):
+    assert client.get("/query/account?format=csv", headers=HEADERS).status_code == 422
+    r = client.get("/query/nope", headers=HEADERS)
+    assert r.status_code == 404
+    assert r.json() == {"error": "Entity 'nope' has not been published"}
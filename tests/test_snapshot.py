@@ -0,0 +1,40 @@
+import os
+
+import pytest
+
+import app as dcl
+
+SOURCES = sorted(d for d in os.listdir(dcl.SCHEMAS_DIR) if os.path.isdir(os.path.join(dcl.SCHEMAS_DIR, d)))
+
+
+@pytest.mark.parametrize("source_key", SOURCES)
+def test_src_views_read_like_read_csv_auto(source_key):
+    fingerprint, tables = dcl.get_snapshot(source_key)
+    dcl.ensure_src_views(source_key, fingerprint, tables)
+    con = dcl.db_connect()
+    for tname, info in tables.items():
+        auto = con.sql(f"SELECT * FROM read_csv_auto({dcl._sql_str(info['path'])})")
+        view = con.sql(f"SELECT * FROM src_{source_key}_{tname}")
+        assert dict(zip(view.columns, map(str, view.types))) == dict(zip(auto.columns, map(str, auto.types))), tname
+        assert view.fetchall() == auto.fetchall(), tname
+
+
+def test_leading_zeros_survive(tmp_path):
+    (tmp_path / "codes.csv").write_text("code,qty,flag\n007,1,true\n010,,false\n123,3,true\n")
+    tables, specs = dcl.snapshot_tables_from_dir("t", str(tmp_path))
+    assert tables["codes"]["schema"]["code"] == "integer"
+    assert specs["codes"]["columns"] == {"code": "VARCHAR", "qty": "BIGINT", "flag": "BOOLEAN"}
+    con = dcl.db_connect()
+    rows = con.sql(f"SELECT * FROM {dcl.csv_reader_sql(str(tmp_path / 'codes.csv'), specs['codes'])}").fetchall()
+    assert rows == [("007", 1, True), ("010", None, False), ("123", 3, True)]
+
+
+def test_text_of_plain_integers_is_read_as_bigint(tmp_path):
+    path = str(tmp_path / "ids.csv")
+    (tmp_path / "ids.csv").write_text("id,code\n7,07\n42,42\n")
+    con = dcl.db_connect()
+    sniffed = dcl.sniff_csv(con, path)
+    # As if the sniffer had seen text: only the column without leading zeros may become BIGINT
+    sniffed["columns"] = {"id": "VARCHAR", "code": "VARCHAR"}
+    _, read_types = dcl.infer_types(con, path, sniffed)
+    assert read_types == {"id": "BIGINT", "code": "VARCHAR"}
@@ -0,0 +1,61 @@
+import pytest
+
+from state_store import SQLiteStateStore, open_state_store
+
+
+@pytest.fixture
+def stores(tmp_path):
+    path = str(tmp_path / "state.db")
+    a, b = SQLiteStateStore(path), SQLiteStateStore(path)
+    yield a, b
+    a.close()
+    b.close()
+
+
+def test_two_stores_on_one_file_share_values_and_versions(stores):
+    a, b = stores
+    assert a.id == b.id
+    versions = a.save({"graph": {"nodes": [1]}, "sources": ["sap"]})
+    assert b.get("graph") == (versions["graph"], {"nodes": [1]})
+    assert b.changed(["graph", "sources", "missing"], {}) == {
+        "graph": (versions["graph"], {"nodes": [1]}), "sources": (versions["sources"], ["sap"])}
+    assert b.changed(["graph", "sources"], versions) == {}
+
+    # Versions come from one sequence, so b's write is newer than anything a wrote
+    newer = b.save({"graph": {"nodes": [2]}})
+    assert newer["graph"] > max(versions.values())
+    assert a.changed(["graph", "sources"], versions) == {"graph": (newer["graph"], {"nodes": [2]})}
+
+    # A deleted key never comes back with a version a reader has already seen
+    a.delete("sources")
+    assert b.get("sources") is None
+    again = b.save({"sources": ["sap"]})
+    assert again["sources"] > newer["graph"]
+
+
+def test_nested_write_lock_rolls_back_on_error(stores):
+    a, b = stores
+    a.save({"kept": 1})
+    with pytest.raises(RuntimeError):
+        with a.write_lock():
+            a.save({"outer": 1})
+            with a.write_lock():
+                a.save({"inner": 1})
+                raise RuntimeError("boom")
+    for store in stores:
+        assert store.get("outer") is None and store.get("inner") is None
+        assert store.get("kept")[1] == 1
+
+    # The lock is released and usable again by either store
+    with b.write_lock():
+        b.save({"after": 1})
+    assert a.get("after")[1] == 1
+
+
+def test_open_state_store(tmp_path):
+    assert not open_state_store("memory").shared
+    store = open_state_store(f"sqlite:{tmp_path / 'state.db'}")
+    assert store.shared
+    store.close()
+    with pytest.raises(ValueError):
+        open_state_store("redis://localhost")
@@ -0,0 +1,79 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import textwrap
+
+from fastapi.testclient import TestClient
+
+import app as dcl
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SESSION = "0123456789abcdef"
+
+
+def run_worker(tmp_path, body):
+    """Run `body` in a fresh worker process on a shared SQLite store; returns what it prints as JSON."""
+    script = "import json, time\nimport app\n" + textwrap.dedent(body)
+    env = dict(os.environ, STATE_STORE=f"sqlite:{tmp_path / 'state.db'}",
+               AUDIT_LOG_PATH=str(tmp_path / "audit.jsonl"), PARQUET_CACHE="0")
+    out = subprocess.run([sys.executable, "-c", script], cwd=ROOT, env=env, capture_output=True, text=True, timeout=120)
+    assert out.returncode == 0, out.stderr
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def test_second_worker_replays_ddl_and_drops_evicted_workspace(tmp_path):
+    views = f"""
+        def views():
+            return sorted(v for (v,) in app.db_connect().sql(
+                "SELECT view_name FROM duckdb_views() WHERE schema_name = 'ws_{SESSION}'").fetchall())
+    """
+    first = run_worker(tmp_path, views + f"""
+        ws = app.get_workspace("{SESSION}")
+        assert app.connect_source("salesforce", ws)["ok"]
+        print(json.dumps(views()))
+    """)
+    assert first and all(v.startswith("dcl_") for v in first)
+
+    second = run_worker(tmp_path, views + f"""
+        app.WORKSPACE_IDLE_S = app.WORKSPACE_TOUCH_S = 0
+        ws = app.get_workspace("{SESSION}")
+        replayed = views()
+        sources = list(ws.sources)
+        time.sleep(0.01)
+        app.get_workspace("fedcba9876543210")  # evicts the idle workspace
+        print(json.dumps({{"replayed": replayed, "sources": sources, "after": views(),
+                          "schemas": [s for (s,) in app.db_connect().sql("SELECT schema_name FROM duckdb_schemas()").fetchall()]}}))
+    """)
+    assert second["replayed"] == first
+    assert second["sources"] == ["salesforce"]
+    assert second["after"] == [] and f"ws_{SESSION}" not in second["schemas"]
+
+    con = sqlite3.connect(str(tmp_path / "state.db"))
+    keys = {k for (k,) in con.execute("SELECT key FROM state")}
+    index = json.loads(con.execute("SELECT value FROM state WHERE key = 'catalog'").fetchone()[0])
+    con.close()
+    assert f"ws:{SESSION}" not in keys and f"catalog:ws_{SESSION}" not in keys
+    assert f"ws_{SESSION}" not in index
+
+
+def test_session_from_cookie_or_header():
+    client = TestClient(dcl.app)
+    assert client.get("/state", headers={"X-DCL-Session": SESSION}).json()["workspace"] == SESSION
+    client.cookies.set(dcl.SESSION_COOKIE, "fedcba9876543210")
+    # The cookie wins over the header
+    assert client.get("/state", headers={"X-DCL-Session": SESSION}).json()["workspace"] == "fedcba9876543210"
+
+
+def test_invalid_session_gets_default_workspace():
+    client = TestClient(dcl.app)
+    assert client.get("/state").json()["workspace"] == dcl.DEFAULT_WORKSPACE
+    assert client.get("/state", headers={"X-DCL-Session": "../../etc"}).json()["workspace"] == dcl.DEFAULT_WORKSPACE
+
+
+def test_index_hands_out_a_session_cookie_once():
+    client = TestClient(dcl.app)
+    sid = client.get("/").cookies.get(dcl.SESSION_COOKIE)
+    assert sid and dcl.SESSION_ID_RE.match(sid)
+    assert dcl.SESSION_COOKIE not in client.get("/").cookies